@@ -1,17 +1,84 @@
 import os
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
 from typing import Optional
+from urllib3.util.retry import Retry
 
 
 GOOGLE_MAPS_API_KEY: Optional[str] = os.getenv("GOOGLE_MAPS_API_KEY")
 NOMINATIM_BASE_URL: str = os.getenv("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org")
+NOMINATIM_CACHE_PATH: str = os.getenv("NOMINATIM_CACHE_PATH", ".nominatim_cache")
+NOMINATIM_CACHE_EXPIRE: int = int(os.getenv("NOMINATIM_CACHE_EXPIRE", str(60 * 60 * 24 * 30)))
 
+HTTP_POOL_CONNECTIONS: int = 8
+HTTP_POOL_MAXSIZE: int = 16
+HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 64
+# Street View metadata answers in ~1s at p99; fail fast on hung probes.
+HTTP_TIMEOUT: float = 10.0
+HTTP_CONNECT_TIMEOUT: float = 3.0
+# Street View probes: max in flight across all requests (halved while Google
+# throttles) and how many recent answers to remember.
+PROBE_CONCURRENCY: int = 16
+PROBE_CACHE_SIZE: int = 50_000
+# Threads available to handlers for blocking work (shapely, Nominatim).
+BLOCKING_EXECUTOR_WORKERS: int = 32
 
-def get_http_session() -> requests.Session:
-    session = requests.Session()
+_NOMINATIM_SESSION: Optional[CachedSession] = None
+_ASYNC_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def _default_headers() -> dict:
     # Nominatim requires a descriptive User-Agent per usage policy.
-    session.headers.update({
+    return {
         "User-Agent": os.getenv("USER_AGENT", "geoguess-python-service/1.0 (contact: dev@example.com)"),
         "Accept": "application/json",
-    })
-    return session 
\ No newline at end of file
+    }
+
+
+def _configure_session(session: requests.Session) -> requests.Session:
+    session.headers.update(_default_headers())
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_nominatim_session() -> CachedSession:
+    # City boundaries rarely change, so Nominatim responses are kept in an
+    # on-disk SQLite cache that survives restarts.
+    global _NOMINATIM_SESSION
+    if _NOMINATIM_SESSION is None:
+        _NOMINATIM_SESSION = _configure_session(CachedSession(
+            NOMINATIM_CACHE_PATH,
+            backend="sqlite",
+            expire_after=NOMINATIM_CACHE_EXPIRE,
+            allowable_methods=["GET"],
+        ))
+    return _NOMINATIM_SESSION
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    # Shared HTTP/2 client for the Street View probes issued from async handlers.
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        _ASYNC_CLIENT = httpx.AsyncClient(
+            http2=True,
+            headers=_default_headers(),
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS),
+        )
+    return _ASYNC_CLIENT
+
+
+async def close_async_http_client() -> None:
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.aclose()
+        _ASYNC_CLIENT = None
@@ -1,58 +1,231 @@
 from __future__ import annotations
 
-import random
-from typing import Any, Dict, List, Optional, Tuple, Union
+import functools
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
 
 import geojson
+import numpy as np
+import orjson
+import shapely
+import shapely.errors
 import shapely.geometry
-import shapely.ops
 import requests
 
-from .config import NOMINATIM_BASE_URL, get_http_session
+from .config import NOMINATIM_BASE_URL, get_nominatim_session
 
 GeoJSONType = Union[Dict[str, Any], geojson.GeoJSON]
 
+# PCG64 generator shared by the vectorized samplers below.
+_RNG = np.random.default_rng()
+
+# Candidates are tested against the polygon in batches. The first batch is
+# sized from the polygon's area / bbox ratio so that it misses with
+# probability _BATCH_MISS_PROBABILITY; it grows if nothing is accepted.
+_SAMPLE_BATCH_SIZE = 1024
+_MIN_SAMPLE_BATCH_SIZE = 16
+_MAX_SAMPLE_BATCH_SIZE = 65536
+_BATCH_MISS_PROBABILITY = 1e-3
+# Sample inside the minimum rotated rectangle only when it is noticeably
+# tighter than the axis-aligned bbox.
+_MRR_AREA_RATIO = 0.85
+# Detailed boundaries (coastlines) are simplified before sampling; 1e-5
+# degrees is about 1 m, far below what matters for picking a location.
+_SIMPLIFY_MIN_COORDS = 1000
+_SIMPLIFY_TOLERANCE = 1e-5
+# Number of parsed/prepared areas kept by prepare_area().
+_PREP_CACHE_SIZE = 64
+
+
+class PreparedArea(NamedTuple):
+    shape: shapely.geometry.base.BaseGeometry  # unioned input geometry
+    parts: np.ndarray  # simplified, prepared polygon parts used for sampling
+    bounds: Tuple[float, float, float, float]
+    areas: np.ndarray  # area of each part
+    cdf: np.ndarray  # cumulative area share of the parts, for _pick_polygon()
+    frames: List[Tuple[np.ndarray, np.ndarray]]  # _sampling_frame() of each part
+
+
+_prep_cache: "OrderedDict[str, PreparedArea]" = OrderedDict()
+_prep_cache_lock = threading.Lock()
+
 
 def _to_shapely_geometry(obj: GeoJSONType) -> shapely.geometry.base.BaseGeometry:
-    if isinstance(obj, dict):
-        gobj = geojson.loads(geojson.dumps(obj))
-    else:
-        gobj = obj
-
-    if isinstance(gobj, geojson.Feature):
-        return shapely.geometry.shape(gobj.geometry)
-    if isinstance(gobj, geojson.FeatureCollection):
-        geoms = [shapely.geometry.shape(f.geometry) for f in gobj.features]
-        return shapely.ops.unary_union(geoms)
+    # GEOS parses the whole document in C, one call however many features
+    # there are; a FeatureCollection comes back as a GeometryCollection.
+    try:
+        geom = shapely.from_geojson(orjson.dumps(obj))
+    except (shapely.errors.GEOSException, shapely.errors.UnsupportedGEOSVersionError):
+        # GEOS < 3.10, or input GEOS rejects (e.g. null geometries).
+        return _shape_from_mapping(obj)
+    if obj.get("type") == "FeatureCollection":
+        return shapely.unary_union(geom)
+    return geom
+
+
+def _shape_from_mapping(obj: GeoJSONType) -> shapely.geometry.base.BaseGeometry:
+    # geojson objects are dict subclasses, so plain dicts and geojson
+    # instances share this path; shape() accepts raw GeoJSON mappings.
+    kind = obj.get("type")
+    if kind == "Feature":
+        return shapely.geometry.shape(obj["geometry"])
+    if kind == "FeatureCollection":
+        geoms = np.array([shapely.geometry.shape(f["geometry"]) for f in obj["features"]], dtype=object)
+        return shapely.unary_union(geoms)
     # Geometry
-    return shapely.geometry.shape(gobj)
+    return shapely.geometry.shape(obj)
 
 
-def _random_point_in_bounds(minx: float, miny: float, maxx: float, maxy: float) -> shapely.geometry.Point:
-    x = random.uniform(minx, maxx)
-    y = random.uniform(miny, maxy)
-    return shapely.geometry.Point(x, y)
+def _simplify_for_sampling(shape: shapely.geometry.base.BaseGeometry) -> shapely.geometry.base.BaseGeometry:
+    # contains() cost grows with the number of edges tested.
+    if shapely.get_num_coordinates(shape) <= _SIMPLIFY_MIN_COORDS:
+        return shape
+    return shapely.simplify(shape, _SIMPLIFY_TOLERANCE, preserve_topology=True)
 
 
-def random_point_in_polygon(geom: GeoJSONType, max_tries: int = 10_000) -> Tuple[float, float]:
-    shape = _to_shapely_geometry(geom)
+def _sampling_frame(shape: shapely.geometry.base.BaseGeometry) -> Tuple[np.ndarray, np.ndarray]:
+    # Candidates are drawn as origin + [a, b] @ axes with a, b ~ U(0, 1).
+    # Long skewed shapes (coastal cities) fill their minimum rotated
+    # rectangle much better than the axis-aligned bbox.
     minx, miny, maxx, maxy = shape.bounds
+    origin = np.array([minx, miny])
+    axes = np.array([[maxx - minx, 0.0], [0.0, maxy - miny]])
 
-    for _ in range(max_tries):
-        pt = _random_point_in_bounds(minx, miny, maxx, maxy)
-        if shape.contains(pt):
-            return (pt.y, pt.x)  # lat, lng
-    raise RuntimeError("Failed to sample a point inside polygon after many attempts")
+    bbox_area = (maxx - minx) * (maxy - miny)
+    mrr = shape.minimum_rotated_rectangle
+    if bbox_area > 0 and mrr.geom_type == "Polygon" and mrr.area / bbox_area <= _MRR_AREA_RATIO:
+        corners = np.asarray(mrr.exterior.coords)[:3]
+        origin = corners[0]
+        axes = np.array([corners[1] - corners[0], corners[2] - corners[1]])
+    return origin, axes
 
 
-def random_points_in_polygon(geom: GeoJSONType, count: int) -> List[Tuple[float, float]]:
-    return [random_point_in_polygon(geom) for _ in range(count)]
+def _batch_size_for(shape: shapely.geometry.base.BaseGeometry, frame: Tuple[np.ndarray, np.ndarray], count: int = 1) -> int:
+    frame_area = abs(float(np.linalg.det(frame[1])))
+    area = shape.area
+    if frame_area <= 0 or area <= 0:
+        return _SAMPLE_BATCH_SIZE
+    # Acceptance probability of a single uniform candidate in the frame.
+    p = min(area / frame_area, 1.0)
+    margin = math.ceil(math.log(_BATCH_MISS_PROBABILITY) / math.log1p(-p)) if p < 1.0 else 1
+    n = math.ceil((count - 1) / p) + margin
+    return min(max(n, _MIN_SAMPLE_BATCH_SIZE), _MAX_SAMPLE_BATCH_SIZE)
 
 
-def fetch_city_geojson(city: str, country: Optional[str] = None) -> Dict[str, Any]:
-    if not city:
-        raise ValueError("city must be provided")
+def _sample_batch(
+    shape: shapely.geometry.base.BaseGeometry,
+    frame: Tuple[np.ndarray, np.ndarray],
+    count: int,
+    max_tries: int = 10_000,
+) -> List[Tuple[float, float]]:
+    # max_tries bounds the number of candidates drawn per requested point.
+    origin, axes = frame
+    batch = _batch_size_for(shape, frame, count)
+    budget = max_tries * count
+
+    accepted: List[np.ndarray] = []
+    remaining = count
+    tried = 0
+    while remaining > 0:
+        if tried >= budget:
+            raise RuntimeError("Failed to sample a point inside polygon after many attempts")
+        n = min(batch, budget - tried)
+        xy = origin + _RNG.random((n, 2)) @ axes
+        # contains_xy tests raw coordinates without building Point objects.
+        hits = xy[shapely.contains_xy(shape, xy[:, 0], xy[:, 1])][:remaining]
+        accepted.append(hits)
+        remaining -= len(hits)
+        tried += n
+        batch = min(batch * 2, _MAX_SAMPLE_BATCH_SIZE)
+    return [(float(y), float(x)) for x, y in np.concatenate(accepted)]  # lat, lng
+
+
+def _area_key(geom: GeoJSONType) -> str:
+    return hashlib.blake2b(orjson.dumps(geom, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+
+def prepare_area(geom: GeoJSONType) -> PreparedArea:
+    """Parse, union, simplify and prepare a GeoJSON area once per distinct input."""
+    key = _area_key(geom)
+    with _prep_cache_lock:
+        cached = _prep_cache.get(key)
+        if cached is not None:
+            _prep_cache.move_to_end(key)
+            return cached
+
+    shape = _to_shapely_geometry(geom)
+    parts = shapely.get_parts(_simplify_for_sampling(shape))
+    # Build the GEOS prepared index once so every contains() reuses it, and
+    # run one query so its lazily built point locator exists before the
+    # parts are shared between threads.
+    shapely.prepare(parts)
+    shapely.contains(parts, shapely.point_on_surface(parts))
+    # Multi-part areas (islands, FeatureCollections of districts) leave most
+    # of the combined frame empty, so each part is sampled inside its own
+    # frame and picked with probability proportional to its area.
+    areas = shapely.area(parts)
+    total = float(areas.sum())
+    cdf = np.cumsum(areas) / total if total > 0 else np.zeros(len(parts))
+    area = PreparedArea(
+        shape=shape,
+        parts=parts,
+        bounds=shape.bounds,
+        areas=areas,
+        cdf=cdf,
+        frames=[_sampling_frame(part) for part in parts],
+    )
 
+    with _prep_cache_lock:
+        _prep_cache[key] = area
+        while len(_prep_cache) > _PREP_CACHE_SIZE:
+            _prep_cache.popitem(last=False)
+    return area
+
+
+def _pick_polygon(cdf: np.ndarray, count: int = 1) -> np.ndarray:
+    # Index of the part each sample falls in; the clamp guards against
+    # rounding leaving cdf[-1] slightly below 1.
+    return np.minimum(np.searchsorted(cdf, _RNG.random(count), side="right"), len(cdf) - 1)
+
+
+def _sample_parts(area: PreparedArea, count: int, max_tries: int = 10_000) -> List[Tuple[float, float]]:
+    # Parts of a unioned shape are disjoint, so area-weighted part picks
+    # keep the result uniform over the whole area.
+    if not area.cdf.size or area.cdf[-1] <= 0:
+        raise RuntimeError("Failed to sample a point inside polygon: geometry has no area")
+
+    per_part = np.bincount(_pick_polygon(area.cdf, count), minlength=len(area.parts))
+
+    points: List[Tuple[float, float]] = []
+    for i in np.flatnonzero(per_part):
+        points.extend(_sample_batch(area.parts[i], area.frames[i], int(per_part[i]), max_tries))
+    return [points[i] for i in _RNG.permutation(len(points))]
+
+
+def random_point_in_polygon(geom: Union[GeoJSONType, PreparedArea], max_tries: int = 10_000) -> Tuple[float, float]:
+    area = geom if isinstance(geom, PreparedArea) else prepare_area(geom)
+    return _sample_parts(area, 1, max_tries)[0]
+
+
+def random_points_in_polygon(geom: Union[GeoJSONType, PreparedArea], count: int) -> List[Tuple[float, float]]:
+    # The area is parsed and prepared once; all samples share its batches.
+    area = geom if isinstance(geom, PreparedArea) else prepare_area(geom)
+    return _sample_parts(area, count)
+
+
+def random_points_on_sphere(count: int) -> List[Tuple[float, float]]:
+    # Uniform on the sphere: z = sin(lat) uniform in [-1, 1], longitude uniform.
+    lats = np.degrees(np.arcsin(_RNG.uniform(-1.0, 1.0, count)))
+    lngs = _RNG.uniform(-180.0, 180.0, count)
+    return list(zip(lats.tolist(), lngs.tolist()))
+
+
+@functools.lru_cache(maxsize=256)
+def _fetch_city_feature_json(city: str, country: Optional[str]) -> bytes:
+    # Cached as serialized bytes so callers never share (and mutate) one dict.
     query = city if not country else f"{city}, {country}"
 
     params = {
@@ -63,11 +236,12 @@ def fetch_city_geojson(city: str, country: Optional[str] = None) -> Dict[str, An
         "limit": 1,
     }
 
-    session = get_http_session()
+    session = get_nominatim_session()
     url = f"{NOMINATIM_BASE_URL.rstrip('/')}/search"
     response = session.get(url, params=params, timeout=20)
     response.raise_for_status()
-    results = response.json()
+    # Boundary polygons are coordinate-heavy; orjson parses them much faster.
+    results = orjson.loads(response.content)
 
     if not results:
         raise ValueError(f"No results for city query: {query}")
@@ -76,11 +250,24 @@ def fetch_city_geojson(city: str, country: Optional[str] = None) -> Dict[str, An
     if "geojson" not in top:
         raise ValueError("City result does not include polygon geojson")
 
-    # Return as Feature
-    return geojson.Feature(geometry=top["geojson"], properties={
-        "display_name": top.get("display_name"),
-        "type": top.get("type"),
-        "osm_type": top.get("osm_type"),
-        "osm_id": top.get("osm_id"),
-        "class": top.get("class"),
-    }) 
\ No newline at end of file
+    # Serialize a plain GeoJSON Feature mapping
+    return orjson.dumps({
+        "type": "Feature",
+        "geometry": top["geojson"],
+        "properties": {
+            "display_name": top.get("display_name"),
+            "type": top.get("type"),
+            "osm_type": top.get("osm_type"),
+            "osm_id": top.get("osm_id"),
+            "class": top.get("class"),
+        },
+    })
+
+
+def fetch_city_geojson(city: str, country: Optional[str] = None) -> Dict[str, Any]:
+    if not city:
+        raise ValueError("city must be provided")
+    # Nominatim matching is case-insensitive; normalize so "Paris" and
+    # "paris " share one cache entry (here and in the on-disk cache).
+    country = country.strip().lower() if country else None
+    return orjson.loads(_fetch_city_feature_json(city.strip().lower(), country or None))
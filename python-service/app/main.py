@@ -1,18 +1,51 @@
 from __future__ import annotations
 
-import os
-from typing import Any, Dict, List, Optional
-
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import quote
+
+import httpx
+import orjson
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, Field, SkipValidation, field_validator
+
+from .config import BLOCKING_EXECUTOR_WORKERS, GOOGLE_MAPS_API_KEY, close_async_http_client
+from .geo import prepare_area, random_points_in_polygon, fetch_city_geojson
+from .streetview import (
+    StreetViewError,
+    find_streetview_random,
+    global_random_lat_lngs,
+    render_panorama_png,
+    reset_probe_limiter,
+    street_view_metadata,
+)
+
+logger = logging.getLogger(__name__)
 
-from .config import GOOGLE_MAPS_API_KEY
-from .geo import random_point_in_polygon, fetch_city_geojson
-from .streetview import street_view_metadata, find_streetview_random, StreetViewError
 
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Bound the threads asyncio.to_thread may fan out to.
+    executor = ThreadPoolExecutor(max_workers=BLOCKING_EXECUTOR_WORKERS)
+    asyncio.get_running_loop().set_default_executor(executor)
+    reset_probe_limiter()
+    yield
+    await close_async_http_client()
+    reset_probe_limiter()
+    executor.shutdown(wait=False)
 
-app = FastAPI(title="GeoGuess Python Street View Service", version="1.0.0")
+
+app = FastAPI(
+    title="GeoGuess Python Street View Service",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,19 +56,41 @@ app.add_middleware(
 )
 
 
+def _check_geojson_object(value: Any) -> Any:
+    # Only the top level is checked; see the SkipValidation note below.
+    if value is not None and not isinstance(value, dict):
+        raise ValueError("geojson must be a GeoJSON object")
+    return value
+
+
 class RandomPointRequest(BaseModel):
-    geojson: Optional[Dict[str, Any]] = Field(default=None, description="Feature, FeatureCollection, or Geometry")
+    # Large boundaries carry MBs of coordinates; skip walking them here, the
+    # geometry code validates structure when it parses the GeoJSON.
+    geojson: SkipValidation[Optional[Dict[str, Any]]] = Field(default=None, description="Feature, FeatureCollection, or Geometry")
     count: int = Field(default=1, ge=1, le=100)
 
+    _check_geojson = field_validator("geojson", mode="before")(_check_geojson_object)
+
 
 class StreetViewRandomRequest(BaseModel):
-    geojson: Optional[Dict[str, Any]] = None
+    geojson: SkipValidation[Optional[Dict[str, Any]]] = None
     city: Optional[str] = None
     country: Optional[str] = None
     all_panorama: bool = False
     optimise: bool = True
     max_attempts: int = Field(default=10, ge=1, le=1000)
     radius: Optional[int] = Field(default=None, ge=1, le=500000)
+    max_concurrent_probes: int = Field(default=4, ge=1, le=32)
+
+    _check_geojson = field_validator("geojson", mode="before")(_check_geojson_object)
+
+
+class StreetViewRandomBatchRequest(StreetViewRandomRequest):
+    count: int = Field(default=16, ge=1, le=64)
+
+
+class StreetViewRandomImageRequest(StreetViewRandomRequest):
+    zoom: int = Field(default=3, ge=0, le=5)
 
 
 @app.get("/health")
@@ -54,7 +109,7 @@ async def get_streetview_metadata(
     all_panorama: bool = Query(False),
 ) -> Dict[str, Any]:
     try:
-        return street_view_metadata(lat, lng, radius=radius, all_panorama=all_panorama)
+        return await street_view_metadata(lat, lng, radius=radius, all_panorama=all_panorama)
     except StreetViewError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -62,23 +117,19 @@ async def get_streetview_metadata(
 @app.post("/random-point")
 async def post_random_point(req: RandomPointRequest) -> Dict[str, Any]:
     if req.geojson is None:
-        # Global random sampling not provided; pick using city or explicit area only in this endpoint
-        from random import random
-        lat = (os.urandom(8)[0] / 255.0) * 180 - 90 if hasattr(os, "urandom") else (random() * 180 - 90)
-        lng = (os.urandom(8)[0] / 255.0) * 360 - 180 if hasattr(os, "urandom") else (random() * 360 - 180)
-        return {"points": [{"lat": lat, "lng": lng}]}
-
-    points = [
-        dict(zip(["lat", "lng"], random_point_in_polygon(req.geojson)))
-        for _ in range(req.count)
-    ]
+        # No area: sample uniformly over the whole sphere.
+        sampled = global_random_lat_lngs(req.count)
+        return {"points": [{"lat": lat, "lng": lng} for lat, lng in sampled]}
+
+    sampled = await asyncio.to_thread(random_points_in_polygon, req.geojson, req.count)
+    points = [{"lat": lat, "lng": lng} for lat, lng in sampled]
     return {"points": points}
 
 
 @app.get("/city-geojson")
 async def get_city_geojson(city: str = Query(...), country: Optional[str] = Query(None)) -> Dict[str, Any]:
     try:
-        feature = fetch_city_geojson(city, country)
+        feature = await asyncio.to_thread(fetch_city_geojson, city, country)
         return feature
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -87,7 +138,7 @@ async def get_city_geojson(city: str = Query(...), country: Optional[str] = Quer
 @app.post("/streetview/random")
 async def post_streetview_random(req: StreetViewRandomRequest) -> Dict[str, Any]:
     try:
-        result = find_streetview_random(
+        result = await find_streetview_random(
             geojson_area=req.geojson,
             city=req.city,
             country=req.country,
@@ -95,7 +146,85 @@ async def post_streetview_random(req: StreetViewRandomRequest) -> Dict[str, Any]
             optimise=req.optimise,
             max_attempts=req.max_attempts,
             radius=req.radius,
+            max_concurrent_probes=req.max_concurrent_probes,
         )
         return result
     except StreetViewError as e:
-        raise HTTPException(status_code=404, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.post("/streetview/random/batch")
+async def post_streetview_random_batch(req: StreetViewRandomBatchRequest) -> Dict[str, Any]:
+    geojson = req.geojson
+    if geojson is None and req.city:
+        # Resolve the city once instead of once per location.
+        try:
+            geojson = await asyncio.to_thread(fetch_city_geojson, req.city, req.country)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    # Likewise parse and prepare the area once; the concurrent searches
+    # would otherwise all miss the prepare_area() cache together.
+    area = await asyncio.to_thread(prepare_area, geojson) if geojson is not None else None
+
+    # Each location gets its own max_attempts; failed ones are left out.
+    outcomes = await asyncio.gather(*(
+        find_streetview_random(
+            geojson_area=area,
+            all_panorama=req.all_panorama,
+            optimise=req.optimise,
+            max_attempts=req.max_attempts,
+            radius=req.radius,
+            max_concurrent_probes=req.max_concurrent_probes,
+        )
+        for _ in range(req.count)
+    ), return_exceptions=True)
+    results: List[Dict[str, Any]] = []
+    for outcome in outcomes:
+        if isinstance(outcome, StreetViewError):
+            logger.info("batch location dropped: %s", outcome)
+        elif isinstance(outcome, httpx.HTTPError):
+            # Transient Google/network failure: drop just this location. The
+            # request URL carries the API key, so log only the error kind.
+            status = outcome.response.status_code if isinstance(outcome, httpx.HTTPStatusError) else None
+            logger.warning("batch location dropped: %s %s", type(outcome).__name__, status or "")
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            results.append(outcome)
+    if not results:
+        raise HTTPException(status_code=404, detail=f"No Street View found for any of {req.count} locations")
+    return {"results": results}
+
+
+@app.post("/streetview/random/image")
+async def post_streetview_random_image(req: StreetViewRandomImageRequest) -> Response:
+    try:
+        result = await find_streetview_random(
+            geojson_area=req.geojson,
+            city=req.city,
+            country=req.country,
+            all_panorama=req.all_panorama,
+            optimise=req.optimise,
+            max_attempts=req.max_attempts,
+            radius=req.radius,
+            max_concurrent_probes=req.max_concurrent_probes,
+        )
+    except StreetViewError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    pano_id = result["metadata"].get("pano_id") or result["metadata"].get("panoId")
+    if not pano_id:
+        raise HTTPException(status_code=404, detail="Street View metadata has no pano_id")
+    try:
+        png = await asyncio.to_thread(render_panorama_png, pano_id, req.zoom)
+    except StreetViewError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Panorama download failed: {e}")
+
+    # The location/metadata JSON rides along in a header, URL-quoted to stay ASCII.
+    return Response(
+        content=png,
+        media_type="image/png",
+        headers={"X-Streetview-Result": quote(orjson.dumps(result).decode())},
+    )
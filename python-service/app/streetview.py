@@ -1,29 +1,123 @@
 from __future__ import annotations
 
+import asyncio
+import io
 import math
-from typing import Any, Dict, Optional, Tuple
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-import requests
+import orjson
+from cachetools import LRUCache
 
-from .config import GOOGLE_MAPS_API_KEY, get_http_session
-from .geo import random_point_in_polygon, fetch_city_geojson
+try:
+    # Optional: only needed to render panoramas server-side.
+    from streetview import get_panorama
+except ImportError:
+    get_panorama = None
+
+from .config import GOOGLE_MAPS_API_KEY, PROBE_CACHE_SIZE, PROBE_CONCURRENCY, get_async_http_client
+from .geo import PreparedArea, prepare_area, random_points_in_polygon, random_points_on_sphere, fetch_city_geojson
 
 
 class StreetViewError(Exception):
     pass
 
 
+class AdaptiveSemaphore:
+    """Concurrency limit that halves when Google throttles and slowly recovers."""
+
+    def __init__(self, limit: int, min_limit: int = 1, recover_after: int = 20, cut_window: float = 1.0) -> None:
+        self._max_limit = limit
+        self._min_limit = min_limit
+        self._recover_after = recover_after
+        self._limit = limit
+        self._in_flight = 0
+        self._successes = 0
+        # A wave of probes hitting the same throttling event must cut once:
+        # ignore reports from probes started before the last cut, and any
+        # report within cut_window seconds of it.
+        self._cut_window = cut_window
+        self._last_cut = -math.inf
+        self._cond = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    async def __aenter__(self) -> "AdaptiveSemaphore":
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def throttled(self, started_at: float) -> None:
+        # `started_at` is the time.monotonic() at which the probe was sent.
+        now = time.monotonic()
+        if started_at < self._last_cut or now - self._last_cut < self._cut_window:
+            return
+        self._limit = max(self._min_limit, self._limit // 2)
+        self._successes = 0
+        self._last_cut = now
+
+    def succeeded(self) -> None:
+        self._successes += 1
+        if self._successes >= self._recover_after and self._limit < self._max_limit:
+            self._limit += 1
+            self._successes = 0
+
+
+# Metadata for (almost) the same spot does not change between probes; only
+# definitive answers are cached, never quota or server errors.
+_CACHEABLE_STATUSES = frozenset({"OK", "ZERO_RESULTS", "NOT_FOUND"})
+# Entries are serialized bytes so callers never share (and mutate) one dict.
+_probe_cache: LRUCache = LRUCache(maxsize=PROBE_CACHE_SIZE)
+# Its asyncio.Condition binds to one event loop, so the limiter is created
+# lazily per loop and reset by the app lifespan.
+_PROBE_LIMITER: Optional[AdaptiveSemaphore] = None
+_PROBE_LIMITER_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_probe_limiter() -> AdaptiveSemaphore:
+    global _PROBE_LIMITER, _PROBE_LIMITER_LOOP
+    loop = asyncio.get_running_loop()
+    if _PROBE_LIMITER is None or _PROBE_LIMITER_LOOP is not loop:
+        _PROBE_LIMITER = AdaptiveSemaphore(PROBE_CONCURRENCY)
+        _PROBE_LIMITER_LOOP = loop
+    return _PROBE_LIMITER
+
+
+def reset_probe_limiter() -> None:
+    global _PROBE_LIMITER, _PROBE_LIMITER_LOOP
+    _PROBE_LIMITER = None
+    _PROBE_LIMITER_LOOP = None
+
+
+def _probe_cache_key(lat: float, lng: float, radius: int, all_panorama: bool) -> Tuple[float, float, int, bool]:
+    # ~11 m grid; radii within 10 m of each other share an entry.
+    return (round(lat, 4), round(lng, 4), radius // 10, all_panorama)
+
+
 def _build_sources_param(all_panorama: bool) -> Optional[str]:
     # Web service uses `source=default|outdoor`. No `google` option here.
     return "default" if not all_panorama else None  # None = let API decide, closer to JS list
 
 
-def street_view_metadata(lat: float, lng: float, radius: int = 50, all_panorama: bool = False, api_key: Optional[str] = None) -> Dict[str, Any]:
+async def street_view_metadata(lat: float, lng: float, radius: int = 50, all_panorama: bool = False, api_key: Optional[str] = None) -> Dict[str, Any]:
     key = api_key or GOOGLE_MAPS_API_KEY
     if not key:
         raise StreetViewError("GOOGLE_MAPS_API_KEY not configured")
 
-    session = get_http_session()
+    cache_key = _probe_cache_key(lat, lng, radius, all_panorama)
+    cached = _probe_cache.get(cache_key)
+    if cached is not None:
+        return orjson.loads(cached)
+
+    client = get_async_http_client()
     params: Dict[str, Any] = {
         "location": f"{lat},{lng}",
         "radius": radius,
@@ -34,35 +128,69 @@ def street_view_metadata(lat: float, lng: float, radius: int = 50, all_panorama:
         params["source"] = source
 
     url = "https://maps.googleapis.com/maps/api/streetview/metadata"
-    response = session.get(url, params=params, timeout=60)
-    response.raise_for_status()
-    return response.json()
+    limiter = get_probe_limiter()
+    async with limiter:
+        started_at = time.monotonic()
+        response = await client.get(url, params=params)
+        if response.status_code == 429 or response.status_code >= 500:
+            limiter.throttled(started_at)
+        response.raise_for_status()
+        metadata = response.json()
+        if metadata.get("status") == "OVER_QUERY_LIMIT":
+            limiter.throttled(started_at)
+        else:
+            limiter.succeeded()
 
+    if metadata.get("status") in _CACHEABLE_STATUSES:
+        _probe_cache[cache_key] = orjson.dumps(metadata)
+    return metadata
 
-def is_metadata_acceptable(metadata: Dict[str, Any], optimise: bool) -> bool:
-    if not metadata or metadata.get("status") != "OK":
-        return False
+
+def _mk_acceptor(optimise: bool) -> Callable[[Optional[Dict[str, Any]]], bool]:
+    # Resolve `optimise` once per search instead of on every probe.
     if optimise:
         # Approximate optimisation similar to frontend (no `links` field available here)
         # Require an image_date when optimising
-        if not metadata.get("date") and not metadata.get("image_date"):
-            return False
-    return True
+        return lambda m: bool(m) and m.get("status") == "OK" and bool(m.get("date") or m.get("image_date"))
+    return lambda m: bool(m) and m.get("status") == "OK"
+
+
+def is_metadata_acceptable(metadata: Dict[str, Any], optimise: bool) -> bool:
+    return _mk_acceptor(optimise)(metadata)
 
 
 def global_random_lat_lng() -> Tuple[float, float]:
-    import random
+    return global_random_lat_lngs(1)[0]
 
-    # Uniform sampling on a sphere: pick z in [-1, 1], longitude uniform
-    z = 2.0 * random.random() - 1.0
-    lat = math.degrees(math.asin(z))
-    lng = 360.0 * random.random() - 180.0
-    return lat, lng
 
+def global_random_lat_lngs(count: int) -> List[Tuple[float, float]]:
+    return random_points_on_sphere(count)
 
-def find_streetview_random(
+
+async def _probe(lat: float, lng: float, **kwargs: Any) -> Tuple[float, float, Dict[str, Any]]:
+    return lat, lng, await street_view_metadata(lat, lng, **kwargs)
+
+
+def _draw_candidates(
+    geojson_area: Optional[Union[Dict[str, Any], PreparedArea]],
+    city: Optional[str],
+    country: Optional[str],
+    count: int,
+    radius: Optional[int],
+) -> Tuple[List[Tuple[float, float]], int]:
+    # Blocking (Nominatim + shapely); run off the event loop.
+    if geojson_area is None and city:
+        geojson_area = fetch_city_geojson(city, country)
+
+    if geojson_area is not None:
+        area = geojson_area if isinstance(geojson_area, PreparedArea) else prepare_area(geojson_area)
+        return random_points_in_polygon(area, count), radius or _estimate_radius_from_area(area)
+    return global_random_lat_lngs(count), radius or 100000
+
+
+async def find_streetview_random(
     *,
-    geojson_area: Optional[Dict[str, Any]] = None,
+    geojson_area: Optional[Union[Dict[str, Any], PreparedArea]] = None,
     city: Optional[str] = None,
     country: Optional[str] = None,
     all_panorama: bool = False,
@@ -70,44 +198,64 @@ def find_streetview_random(
     max_attempts: int = 10,
     radius: Optional[int] = None,
     api_key: Optional[str] = None,
+    max_concurrent_probes: int = 4,
 ) -> Dict[str, Any]:
-    if geojson_area is None and city:
-        geojson_area = fetch_city_geojson(city, country)
+    # Draw every candidate up front so probes can be issued concurrently.
+    candidates, effective_radius = await asyncio.to_thread(
+        _draw_candidates, geojson_area, city, country, max_attempts, radius,
+    )
 
+    is_acceptable = _mk_acceptor(optimise)
     attempt = 0
     last_metadata: Optional[Dict[str, Any]] = None
 
-    while attempt < max_attempts:
-        attempt += 1
-        if geojson_area is not None:
-            lat, lng = random_point_in_polygon(geojson_area)
-            effective_radius = radius or _estimate_radius_from_area(geojson_area)
-        else:
-            lat, lng = global_random_lat_lng()
-            effective_radius = radius or 100000
-
-        metadata = street_view_metadata(lat, lng, radius=effective_radius, all_panorama=all_panorama, api_key=api_key)
-        last_metadata = metadata
-        if is_metadata_acceptable(metadata, optimise=optimise):
-            return {
-                "latitude": lat,
-                "longitude": lng,
-                "radius": effective_radius,
-                "metadata": metadata,
-                "attempts": attempt,
-            }
+    # Probe in waves of max_concurrent_probes; the first acceptable response
+    # wins and the rest of its wave is cancelled.
+    for start in range(0, max_attempts, max_concurrent_probes):
+        tasks = [
+            asyncio.ensure_future(_probe(lat, lng, radius=effective_radius, all_panorama=all_panorama, api_key=api_key))
+            for lat, lng in candidates[start:start + max_concurrent_probes]
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                lat, lng, metadata = await next_done
+                attempt += 1
+                last_metadata = metadata
+                if is_acceptable(metadata):
+                    return {
+                        "latitude": lat,
+                        "longitude": lng,
+                        "radius": effective_radius,
+                        "metadata": metadata,
+                        "attempts": attempt,
+                    }
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     raise StreetViewError(f"No Street View found after {max_attempts} attempts; last status={last_metadata and last_metadata.get('status')}")
 
 
-def _estimate_radius_from_area(geojson_area: Dict[str, Any]) -> int:
-    from shapely.geometry import shape
-
-    geom = shape(geojson_area["geometry"]) if geojson_area.get("type") == "Feature" else shape(geojson_area)
-    minx, miny, maxx, maxy = geom.bounds
+def _estimate_radius_from_area(area: PreparedArea) -> int:
+    minx, miny, maxx, maxy = area.bounds
     # Rough heuristic similar to bbox span times factor
     dx = abs(maxx - minx)
     dy = abs(maxy - miny)
     # 1 degree ~ 111km. Use a factor to widen search a bit.
     km_span = max(dx, dy) * 111.0
-    return max(50, int(km_span * 10)) 
\ No newline at end of file
+    return max(50, int(km_span * 10))
+
+
+def render_panorama_png(pano_id: str, zoom: int = 3) -> bytes:
+    # Blocking (tile downloads + PNG encode); run off the event loop.
+    if get_panorama is None:
+        raise StreetViewError("the `streetview` package is required to render panoramas")
+    # Unlike the batch script, tiles are fetched sequentially here: renders
+    # already run concurrently on the bounded default executor, and a tile
+    # pool per render would multiply threads (and Google traffic) per worker.
+    panorama = get_panorama(pano_id, multi_threaded=False, zoom=zoom)
+    buf = io.BytesIO()
+    # Fast zlib level: several times quicker to encode, files only slightly larger.
+    panorama.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
@@ -5,49 +5,93 @@ import argparse
 import os
 import sys
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Any, Dict, Optional
 from streetview import get_panorama
 
+import orjson
 import requests
-import json
 from uuid import uuid4
 from tqdm import tqdm
 
-from gawc_city import list_gawc_city
-from get_panorama import build_parser, request_pano_pipeline
+from gawc_city import load_gawc_city
+from get_panorama import build_parser, download_result, request_pano_pipeline, request_random_panoramas
+
+def _job_args(args, city: str) -> argparse.Namespace:
+    # 更换参数（复制一份 args，并发时各线程互不干扰）
+    job_args = argparse.Namespace(**vars(args))
+    job_args.city = city
+    job_args.output = os.path.join(args.batch_out_dir, str(uuid4()), "panorama.png")
+    return job_args
+
+def _save_result(job_args, city: str, rst) -> int:
+    """成功时把 metadata.json 写到全景图旁边；返回状态码。"""
+    if rst[0] == 0:
+        metadata_output = os.path.join(os.path.dirname(job_args.output), "metadata.json")
+        rst[1].update({"city": city})
+        with open(metadata_output, "wb") as f:
+            f.write(orjson.dumps(rst[1], option=orjson.OPT_INDENT_2))
+    else:
+        print("Fail")
+    return rst[0]
+
+def query_one(args, cities) -> list[tuple[str, int]]:
+    """随机选一个城市跑一次 pipeline；返回 [(城市, 状态码)]。"""
+    city = random.choice(cities)
+    job_args = _job_args(args, city)
+    return [(city, _save_result(job_args, city, request_pano_pipeline(job_args)))]
+
+def query_batch(args, cities, count: int) -> list[tuple[str, int]]:
+    """随机选一个城市，一次请求拿回 count 个位置再逐个下载；返回每个位置的 (城市, 状态码)。"""
+    city = random.choice(cities)
+    try:
+        results = request_random_panoramas(
+            args.app_base_url,
+            count=count,
+            city=city,
+            country=args.country,
+            all_panorama=bool(args.all_panorama),
+            optimise=bool(args.optimise),
+            max_attempts=int(args.max_attempts),
+        )
+    except Exception as e:
+        print(f"Error requesting panoramas: {e}")
+        results = []
+
+    statuses = []
+    for result in results:
+        job_args = _job_args(args, city)
+        statuses.append((city, _save_result(job_args, city, download_result(job_args, result))))
+    # 没找到街景的位置记为失败，保证进度条总数对得上
+    statuses.extend((city, 1) for _ in range(count - len(results)))
+    return statuses
 
 def main():
     args = build_parser().parse_args()
 
-    # 抽取 GAWC 全球排名靠前城市，保证全景图采集来自大城市 
-    cities = list_gawc_city(threshold="Beta-", strictly_higher=True)
+    # 抽取 GAWC 全球排名靠前城市，保证全景图采集来自大城市（读取冻结列表，缺失时才联网抓取）
+    cities = load_gawc_city(threshold="Beta-", strictly_higher=True)
 
     num_success = 0
-    # 序列 query，避免 Google 封号
+    # 默认 --concurrency 1 即序列 query，避免 Google 封号；调大后多个 query 并发等待网络
     progress_bar = tqdm(total=args.num_query, desc="Querying")
     progress_bar.set_postfix(cur_city='None', success=num_success)
 
     # 开始 query
-    for i in range(args.num_query):
-        city = random.choice(cities)
-        output = os.path.join(args.batch_out_dir, str(uuid4()))
-        img_output = os.path.join(output, "panorama.png")
-
-        # 更换参数
-        args.city = city
-        args.output = img_output
-        rst = request_pano_pipeline(args)
-        if rst[0] == 0:
-            num_success += 1
-            metadata_output = os.path.join(output, "metadata.json")
-            rst[1].update({"city": city})
-            with open(metadata_output, "w") as f:
-                json.dump(rst[1], f, indent=4)
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        if args.batch_size > 1:
+            # 每个 job 向 app 服务一次要 batch_size 个位置（同一城市）
+            batch_size = min(args.batch_size, 64)  # 服务端上限
+            sizes = [min(batch_size, args.num_query - start) for start in range(0, args.num_query, batch_size)]
+            futures = [pool.submit(query_batch, args, cities, size) for size in sizes]
         else:
-            print("Fail")
-
-        progress_bar.update(1)
-        progress_bar.set_postfix(cur_city=city, status=rst[0], success=num_success)
+            futures = [pool.submit(query_one, args, cities) for _ in range(args.num_query)]
+        for future in as_completed(futures):
+            for city, status in future.result():
+                if status == 0:
+                    num_success += 1
+                progress_bar.update(1)
+                progress_bar.set_postfix(cur_city=city, status=status, success=num_success)
     progress_bar.close()
     print(f"Total queries: {args.num_query}, success: {num_success}")
 
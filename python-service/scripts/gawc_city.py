@@ -4,17 +4,39 @@
 “2024 city classification” 的城市列表，并返回“高于 threshold (默认: Beta-)”的城市列表。
 包含丰富的 debug 打印，便于定位问题。
 
+抓取结果缓存在 ~/.cache/gawc_2024.json：7 天内直接复用；过期后带 ETag
+发起条件请求，页面未变 (304) 时仍复用缓存，避免重复下载与解析。
+
 依赖:
     pip install requests beautifulsoup4
+    pip install lxml  # 可选，更快的 HTML 解析器
 """
 
+import functools
+import json
+import os
 import re
 import sys
+import time
+from itertools import chain
 import requests
 from bs4 import BeautifulSoup, Tag
 
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
 WIKI_URL = "https://en.wikipedia.org/wiki/Globalization_and_World_Cities_Research_Network"
 
+# 抓取结果的本地缓存及有效期（秒）
+CACHE_PATH = os.path.expanduser("~/.cache/gawc_2024.json")
+CACHE_MAX_AGE = 7 * 24 * 3600
+
+# 冻结的城市列表（首次运行时生成，已加入 .gitignore），batch_panorama 启动时直接读取，不再联网抓取
+FROZEN_CITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "data", "gawc_cities.json")
+
 # 等级从高到低的“标准写法”（全部用 ASCII '-'）
 LEVELS = [
     "Alpha ++", "Alpha +", "Alpha", "Alpha -",
@@ -25,17 +47,24 @@ LEVELS = [
 
 MAIN_SECTIONS = {"Alpha", "Beta", "Gamma", "Sufficiency"}  # h3 主段
 
+# normalize_dashes / extract_city_from_li 用到的替换表与预编译正则
+_DASH_TABLE = str.maketrans({"−": "-", "–": "-", "—": "-"})
+_RE_DASH = re.compile(r"\s*-\s*")
+_RE_PLUS = re.compile(r"\s*\+\s*")
+_RE_WS = re.compile(r"\s+")
+_RE_TRAILING_PAREN_NUM = re.compile(r"\(\d+\)\s*$")
+_RE_TRAILING_REF = re.compile(r"\[\d+\]\s*$")
+
 def normalize_dashes(s: str) -> str:
     """把各种 dash/minus 统一成 ASCII '-'，并压缩空格，使 'Alpha−' / 'Alpha–' 等能对齐到 'Alpha -'。"""
     if not s:
         return s
-    s = s.replace("−", "-").replace("–", "-").replace("—", "-")
+    s = s.translate(_DASH_TABLE)
     # 'Alpha-' / 'Alpha  -' -> 'Alpha -'
-    s = re.sub(r"\s*-\s*", " - ", s)
+    s = _RE_DASH.sub(" - ", s)
     # 'Alpha+' -> 'Alpha +'
-    s = re.sub(r"\s*\+\s*", " + ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    s = _RE_PLUS.sub(" + ", s)
+    return _RE_WS.sub(" ", s).strip()
 
 def canonical_level(raw: str) -> str:
     """把抓到的标题文本规范化到 LEVELS 中的写法；不匹配则返回空串。"""
@@ -45,6 +74,21 @@ def canonical_level(raw: str) -> str:
             return lv
     return ""
 
+def slice_2024_section(html: str) -> str:
+    """
+    在原始 HTML 文本里截出 '2024 city classification' 这一段（从它的 <h2 到下一个 <h2>），
+    只把这一小段交给 BeautifulSoup，避免为整页（500KB+，约 10 万个标签）建树。
+    找不到锚点时原样返回整页，交给 find_h2_2024 的文本兜底。
+    """
+    anchor = html.find('id="2024_city_classification"')
+    if anchor < 0:
+        return html
+    start = html.rfind("<h2", 0, anchor)
+    if start < 0:
+        return html
+    end = html.find("<h2", anchor)
+    return html[start:end] if end >= 0 else html[start:]
+
 def find_h2_2024(soup: BeautifulSoup, debug=True) -> Tag | None:
     """
     找到“2024 city classification”的 h2。
@@ -97,26 +141,63 @@ def extract_city_from_li(li: Tag) -> str:
 
     text = li.get_text(" ", strip=True)
     # 去掉诸如 "(1)" "(2)" 的标记
-    text = re.sub(r"\(\d+\)\s*$", "", text).strip()
+    text = _RE_TRAILING_PAREN_NUM.sub("", text).strip()
     # 去掉文末引用 [1] [2]
-    text = re.sub(r"\[\d+\]\s*$", "", text).strip()
+    text = _RE_TRAILING_REF.sub("", text).strip()
     return text
 
+def load_cache() -> dict | None:
+    """读取本地缓存：{"fetched_at": 秒级时间戳, "etag": str | None, "by_level": {...}}；不存在、损坏或为空返回 None。"""
+    try:
+        with open(CACHE_PATH, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or not isinstance(cache.get("by_level"), dict):
+        return None
+    # 旧版本可能缓存过空结果，当作没有缓存
+    if not any(cache["by_level"].values()):
+        return None
+    return cache
+
+def save_cache(by_level: dict[str, list[str]], etag: str | None) -> None:
+    """写入本地缓存（先写临时文件再 rename，避免并发读到半个文件）。"""
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    tmp_path = f"{CACHE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": time.time(), "etag": etag, "by_level": by_level}, f, ensure_ascii=False)
+    os.replace(tmp_path, CACHE_PATH)
+
 def scrape_2024(debug=True) -> dict[str, list[str]]:
     """
     抓取 '2024 city classification' 段落内的所有等级与城市。
     返回: { level: [city, ...], ... }  其中 level ∈ LEVELS
+    优先使用本地缓存（见 CACHE_PATH / CACHE_MAX_AGE）。
     """
+    cache = load_cache()
+    if cache and time.time() - cache.get("fetched_at", 0) < CACHE_MAX_AGE:
+        print("[cache] 使用本地缓存：", CACHE_PATH)
+        return cache["by_level"]
+
     headers = {
         "User-Agent": "Mozilla/5.0 (compatible; GaWC-Crawler/1.0; +https://example.com)"
     }
+    if cache and cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
     print("[1/7] 请求页面：", WIKI_URL)
     resp = requests.get(WIKI_URL, headers=headers, timeout=30)
     print("[2/7] HTTP 状态码：", resp.status_code)
+    if resp.status_code == 304 and cache:
+        print("[cache] 页面未变化 (304)，沿用本地缓存：", CACHE_PATH)
+        save_cache(cache["by_level"], cache.get("etag"))
+        return cache["by_level"]
     resp.raise_for_status()
     print("[3/7] HTML 长度：", len(resp.text))
 
-    soup = BeautifulSoup(resp.text, "html.parser")
+    section = slice_2024_section(resp.text)
+    if debug:
+        print(f"[debug] 截取 2024 段落：{len(section)} / {len(resp.text)} 字符")
+    soup = BeautifulSoup(section, HTML_PARSER)
     h2 = find_h2_2024(soup, debug=debug)
     if not h2:
         raise RuntimeError("未找到 '2024 city classification' 的 h2 标题；页面结构可能变化。")
@@ -169,12 +250,8 @@ def scrape_2024(debug=True) -> dict[str, list[str]]:
                 if name:
                     cities.append(name)
 
-            # 去重保序
-            deduped, seen = [], set()
-            for c in cities:
-                if c not in seen:
-                    seen.add(c)
-                    deduped.append(c)
+            # 去重保序（dict 保留插入顺序）
+            deduped = list(dict.fromkeys(cities))
 
             by_level[lv].extend(deduped)
             print(f"[5/7] 抓到子等级: {lv:<18} 城市数: {len(deduped):>3}  示例: {deduped[:5]}")
@@ -184,7 +261,12 @@ def scrape_2024(debug=True) -> dict[str, list[str]]:
     for lv in LEVELS:
         print(f"         {lv:<18} -> {len(by_level[lv])}")
 
+    if total == 0:
+        # 解析失败时不写缓存，否则 7 天内都会读到空结果
+        raise RuntimeError("'2024 city classification' 段落里没有解析出任何城市；页面结构可能变化。")
+
     print("[7/7] 解析完成。")
+    save_cache(by_level, resp.headers.get("ETag"))
     return by_level
 
 def list_gawc_city(threshold: str = "Beta-", strictly_higher: bool = True, debug: bool = True) -> list[str]:
@@ -197,7 +279,14 @@ def list_gawc_city(threshold: str = "Beta-", strictly_higher: bool = True, debug
         Beta + / Beta / Beta -
         Gamma + / Gamma / Gamma -
         High sufficiency / Sufficiency
+
+    同一进程内相同参数只抓取/计算一次，返回的是缓存结果的副本。
     """
+    return list(_list_gawc_city_cached(threshold, strictly_higher, debug))
+
+@functools.lru_cache(maxsize=32)
+def _list_gawc_city_cached(threshold: str, strictly_higher: bool, debug: bool) -> tuple[str, ...]:
+    """list_gawc_city 的带缓存实现；返回 tuple，避免调用方修改缓存内容。"""
     th_norm = normalize_dashes(threshold)
     th_canon = ""
     for lv in LEVELS:
@@ -216,21 +305,50 @@ def list_gawc_city(threshold: str = "Beta-", strictly_higher: bool = True, debug
     keep = LEVELS[:idx] if strictly_higher else LEVELS[:idx+1]
     print(f"[debug] 参与筛选的等级（高->低）：{keep}")
 
-    merged, seen = [], set()
-    for lv in keep:
-        for city in by_level.get(lv, []):
-            if city not in seen:
-                seen.add(city)
-                merged.append(city)
+    merged = list(dict.fromkeys(chain.from_iterable(by_level.get(lv, ()) for lv in keep)))
 
     print(f"[debug] 最终筛选城市数：{len(merged)}")
-    return merged
+    return tuple(merged)
+
+def freeze_gawc_city(threshold: str = "Beta-", strictly_higher: bool = True, path: str = FROZEN_CITIES_PATH) -> list[str]:
+    """抓取（或读缓存）后把城市列表连同筛选参数写入 path，返回城市列表。页面更新后重跑即可刷新。"""
+    cities = list_gawc_city(threshold=threshold, strictly_higher=strictly_higher)
+    if not cities:
+        raise RuntimeError(f"阈值 {threshold!r} 以上没有抓到任何城市；页面结构可能变化，不写入 {path}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"threshold": threshold, "strictly_higher": strictly_higher, "cities": cities},
+                  f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    print(f"[freeze] 写入 {len(cities)} 个城市：{path}")
+    return cities
+
+def load_gawc_city(threshold: str = "Beta-", strictly_higher: bool = True, path: str = FROZEN_CITIES_PATH) -> list[str]:
+    """
+    优先读取冻结的城市列表；文件不存在、损坏、列表为空或筛选参数不一致时，抓取并重新冻结。
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            frozen = json.load(f)
+        # 空列表视为无效（多半是解析失败），重新抓取
+        if (isinstance(frozen, dict) and isinstance(frozen.get("cities"), list) and frozen["cities"]
+                and normalize_dashes(frozen.get("threshold", "")).lower() == normalize_dashes(threshold).lower()
+                and frozen.get("strictly_higher") == strictly_higher):
+            return list(frozen["cities"])
+    except (OSError, ValueError):
+        pass
+    return freeze_gawc_city(threshold=threshold, strictly_higher=strictly_higher, path=path)
 
 
 if __name__ == "__main__":
     # 用法：
     #   python list_gawc_city.py
     #   python list_gawc_city.py "Alpha"
+    #   python list_gawc_city.py --freeze   # 刷新 app/data/gawc_cities.json（Beta- 以上）
+    if "--freeze" in sys.argv[1:]:
+        freeze_gawc_city()
+        sys.exit(0)
     thr = "gamma+"
     if len(sys.argv) >= 2:
         thr = sys.argv[1]
@@ -3,11 +3,82 @@ from __future__ import annotations
 
 import argparse
 import os
+import random
+import shutil
 import sys
-from typing import Any, Dict, Optional
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote
 from streetview import get_panorama
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 复用同一个 Session，循环调用时保持与 app 服务的 keep-alive 连接；
+# 429/5xx 与连接错误按指数退避自动重试（/streetview/random 只是随机抽样，重试 POST 无副作用）；
+# 读超时不重试（read=0）：慢请求再发一遍只会让服务端重复整次街景搜索
+_RETRY = Retry(
+    total=5,
+    read=0,
+    backoff_factor=0.2,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET", "POST"}),
+    raise_on_status=False,
+)
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=_RETRY)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# 本进程内已确认存在于 --pano-cache-dir 的缓存文件，命中时连 stat 都省掉
+_CACHED_PANOS: set[str] = set()
+
+
+class TokenBucket:
+    """线程安全的令牌桶：平均每秒 rate 次，最多连发 burst 次；acquire() 在没有令牌时睡到有为止。"""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_LIMITERS: Dict[float, TokenBucket] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_download_limiter(max_rate: Optional[float]) -> Optional[TokenBucket]:
+    """按 --max-rate 返回进程内共享的限速器（所有并发线程共用一个桶）；max_rate 为空或 <= 0 时不限速。"""
+    if not max_rate or max_rate <= 0:
+        return None
+    with _LIMITERS_LOCK:
+        if max_rate not in _LIMITERS:
+            _LIMITERS[max_rate] = TokenBucket(max_rate, burst=max(1, int(max_rate)))
+        return _LIMITERS[max_rate]
+
+
+def _post_json(url: str, payload: Dict[str, Any], timeout: float) -> requests.Response:
+    """用 orjson 序列化请求体后 POST（requests 的 json= 走的是较慢的标准库 json）。"""
+    return _SESSION.post(url, data=orjson.dumps(payload), headers=_JSON_HEADERS, timeout=timeout)
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -87,6 +158,41 @@ def build_parser() -> argparse.ArgumentParser:
         required=True,
         help="Output directory (default: panorama_batch)",
     )
+    parser.add_argument(
+        "--concurrency",
+        default=1,
+        type=int,
+        help="Number of queries in flight at once (default: 1, i.e. sequential)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=1,
+        type=int,
+        help="Locations fetched per app request for one city (default: 1; max 64)",
+    )
+    parser.add_argument(
+        "--multi-threaded",
+        dest="multi_threaded",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+        help="Download the tiles of one panorama in parallel (default: on)",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=0.0,
+        help="Max panorama downloads per second across all workers (default: 0, unlimited)",
+    )
+    parser.add_argument(
+        "--pano-cache-dir",
+        default=os.getenv("PANO_CACHE_DIR"),
+        help="Cache downloaded panoramas by pano_id here and reuse them (default: PANO_CACHE_DIR env, off if unset)",
+    )
+    parser.add_argument(
+        "--server-download",
+        action="store_true",
+        help="Let the app service find the location and download the PNG in one request",
+    )
     return parser
 
 
@@ -107,10 +213,63 @@ def request_random_panorama(
         "optimise": optimise,
         "max_attempts": max_attempts,
     }
-    resp = requests.post(url, json=payload, timeout=60)
+    resp = _post_json(url, payload, timeout=60)
     if resp.status_code != 200:
         raise RuntimeError(f"App service error {resp.status_code}: {resp.text}")
-    return resp.json()
+    return orjson.loads(resp.content)
+
+
+def request_random_panoramas(
+    app_base_url: str,
+    *,
+    count: int,
+    city: Optional[str],
+    country: Optional[str],
+    all_panorama: bool,
+    optimise: bool,
+    max_attempts: int,
+) -> List[Dict[str, Any]]:
+    """一次请求拿回最多 count 个有街景的位置（/streetview/random/batch），省掉 count-1 次往返。"""
+    url = app_base_url.rstrip("/") + "/streetview/random/batch"
+    payload: Dict[str, Any] = {
+        "count": count,
+        "city": city,
+        "country": country,
+        "all_panorama": all_panorama,
+        "optimise": optimise,
+        "max_attempts": max_attempts,
+    }
+    resp = _post_json(url, payload, timeout=120)
+    if resp.status_code != 200:
+        raise RuntimeError(f"App service error {resp.status_code}: {resp.text}")
+    return orjson.loads(resp.content)["results"]
+
+
+def request_random_panorama_png(
+    app_base_url: str,
+    *,
+    city: Optional[str],
+    country: Optional[str],
+    all_panorama: bool,
+    optimise: bool,
+    max_attempts: int,
+    zoom: int = 3,
+) -> Tuple[Dict[str, Any], bytes]:
+    """由 app 服务一次完成找位置 + 下载全景图（/streetview/random/image）；返回 (位置结果, PNG 字节)。"""
+    url = app_base_url.rstrip("/") + "/streetview/random/image"
+    payload: Dict[str, Any] = {
+        "city": city,
+        "country": country,
+        "all_panorama": all_panorama,
+        "optimise": optimise,
+        "max_attempts": max_attempts,
+        "zoom": zoom,
+    }
+    resp = _post_json(url, payload, timeout=180)
+    if resp.status_code != 200:
+        raise RuntimeError(f"App service error {resp.status_code}: {resp.text}")
+    result = orjson.loads(unquote(resp.headers["X-Streetview-Result"]))
+    return result, resp.content
 
 
 def download_streetview_png(
@@ -124,23 +283,75 @@ def download_streetview_png(
     fov: float,
     output: str,
     zoom: int = 3,
+    download_attempts: int = 4,
+    multi_threaded: bool = True,
+    cache_dir: Optional[str] = None,
+    rate_limiter: Optional[TokenBucket] = None,
 ):
-    try:
-        panorama = get_panorama(pano_id, multi_threaded=False, zoom=zoom)
-    except Exception as e:
-        print(f"Error downloading panorama: {e}")
-        return False
+    cache_path = os.path.join(cache_dir, f"{pano_id}_z{zoom}.png") if cache_dir and pano_id else None
+    if cache_path and (cache_path in _CACHED_PANOS or os.path.isfile(cache_path)):
+        _CACHED_PANOS.add(cache_path)
+        _place_file(cache_path, output)
+        return True
+
+    panorama = None
+    for attempt in range(download_attempts):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            panorama = get_panorama(pano_id, multi_threaded=multi_threaded, zoom=zoom)
+            break
+        except Exception as e:
+            # 连接错误 streetview 库已按 tile 重试过（每次间隔 2 秒），这里不再叠加重试；
+            # 其余网络类错误指数退避 + 随机抖动后重试
+            if not _is_retryable_download_error(e) or attempt + 1 == download_attempts:
+                print(f"Error downloading panorama: {e}")
+                return False
+            time.sleep(random.uniform(0, min(8.0, 0.2 * 2 ** attempt)))
 
     os.makedirs(os.path.dirname(output), exist_ok=True)
-    panorama.save(output, format="PNG")
+    # zlib 等级 1：编码快数倍，文件只略大
+    panorama.save(output, format="PNG", compress_level=1)
+
+    if cache_path:
+        # 先写临时文件再 rename，并发的进程/线程不会读到半个文件
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(output, tmp_path)
+        os.replace(tmp_path, cache_path)
+        _CACHED_PANOS.add(cache_path)
     return True
 
 
+def _is_retryable_download_error(exc: BaseException) -> bool:
+    """
+    multi_threaded=True 时 streetview 把 tile 的异常包成裸 Exception（原异常在 __cause__），
+    所以沿异常链找 requests 的异常。ConnectionError 已在库内重试过，不算可重试。
+    """
+    while exc is not None:
+        if isinstance(exc, requests.RequestException):
+            return not isinstance(exc, requests.ConnectionError)
+        exc = exc.__cause__
+    return False
+
+
+def _place_file(src: str, dst: str) -> None:
+    """把缓存的全景图放到 dst：优先硬链接（不占额外空间），跨盘等情况退回复制。"""
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
 def request_pano_pipeline(args) -> int:
     if not args.google_api_key:
         print("ERROR: --google-api-key not provided and GOOGLE_MAPS_API_KEY not set", file=sys.stderr)
         return 2
 
+    if getattr(args, "server_download", False):
+        return server_download_pipeline(args)
+
     print("Requesting a random Street View location from app service...")
     try:
         result = request_random_panorama(
@@ -155,6 +366,35 @@ def request_pano_pipeline(args) -> int:
         print(f"Error requesting panorama: {e}")
         return 1, None
 
+    return download_result(args, result)
+
+
+def server_download_pipeline(args):
+    """--server-download：一个请求拿回位置和 PNG，直接写入 args.output；返回 (0, metadata) 或 (1, None)。"""
+    print("Requesting a random Street View panorama from app service...")
+    try:
+        result, png = request_random_panorama_png(
+            args.app_base_url,
+            city=args.city,
+            country=args.country,
+            all_panorama=bool(args.all_panorama),
+            optimise=bool(args.optimise),
+            max_attempts=int(args.max_attempts),
+        )
+    except Exception as e:
+        print(f"Error requesting panorama: {e}")
+        return 1, None
+
+    output = str(args.output)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "wb") as f:
+        f.write(png)
+    print(f"Saved lat={result['latitude']}, lng={result['longitude']} to {output}. Done.")
+    return 0, result.get("metadata", {})
+
+
+def download_result(args, result: Dict[str, Any]):
+    """按 app 服务返回的一个位置下载全景图到 args.output；返回 (0, metadata) 或 (1, None)。"""
     lat = float(result["latitude"])
     lng = float(result["longitude"])
     metadata = result.get("metadata", {})
@@ -172,6 +412,9 @@ def request_pano_pipeline(args) -> int:
         pitch=float(args.pitch),
         fov=float(args.fov),
         output=str(args.output),
+        multi_threaded=bool(getattr(args, "multi_threaded", True)),
+        cache_dir=getattr(args, "pano_cache_dir", None),
+        rate_limiter=get_download_limiter(getattr(args, "max_rate", None)),
     )
 
     if rst: